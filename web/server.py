@@ -6,17 +6,31 @@ Compatible avec les plateformes cloud (Render, Railway, Fly.io).
 """
 
 import asyncio
-import json
+import base64
+import contextlib
+import itertools
+import logging
 import os
 import random
-import string
+import re
 import shutil
+import threading
+import time
 import hashlib
+import hmac
 import secrets
 import html as html_mod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from aiohttp import web
+import orjson
+from aiohttp import WSCloseCode, web
+
+try:
+    import uvloop  # optional: faster event loop (Linux/macOS)
+except ImportError:
+    uvloop = None
 
 # --- Stockfish Engine (python-chess) ---
 import chess
@@ -30,6 +44,49 @@ STATIC_DIR = Path(__file__).parent / "static"
 DATABASE_URL = os.environ.get("DATABASE_URL", "").strip()
 CHESS_DB_PATH = os.environ.get("CHESS_DB_PATH", "").strip()
 CHESS_REQUIRE_DATABASE = os.environ.get("CHESS_REQUIRE_DATABASE", "0").strip() == "1"
+WS_WRITE_BUFFER_HIGH = 2 ** 20  # transport high-water mark once a player is in a room
+WS_MAX_MSG_SIZE = 1 << 20  # largest inbound frame (a full sync_state is a few KiB)
+WS_OUTBOX_SIZE = 64  # frames queued for one connection before it is deemed stuck
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").strip().upper()
+
+# Messages keep their [DB] / [WS] / [STOCKFISH] tags; lazy %-args so nothing
+# is formatted for records below LOG_LEVEL.
+logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO), format="%(message)s")
+logger = logging.getLogger("chess_online")
+
+# --- Wire encoding (orjson) ---
+def _dumps(obj):
+    """Serialize an outbound payload with orjson (str, for TEXT frames)."""
+    return orjson.dumps(obj).decode()
+
+
+def _loads(data):
+    """Parse an inbound frame / request body (str or bytes) into a dict.
+    Raises orjson.JSONDecodeError if it is not a JSON object."""
+    msg = orjson.loads(data)
+    if not isinstance(msg, dict):
+        raise orjson.JSONDecodeError("expected a JSON object", "", 0)
+    return msg
+
+
+# Static messages, encoded once at import
+MSG_PONG = _dumps({"type": "pong"})
+MSG_OPPONENT_RESIGNED = _dumps({"type": "opponent_resigned"})
+MSG_OPPONENT_DISCONNECTED = _dumps({"type": "opponent_disconnected"})
+MSG_OPPONENT_DISCONNECTED_FINAL = _dumps({"type": "opponent_disconnected_final"})
+MSG_OPPONENT_RECONNECTED = _dumps({"type": "opponent_reconnected"})
+MSG_MATCHMAKING_CANCELLED = _dumps({"type": "matchmaking_cancelled"})
+MSG_SYNC_REQUEST = _dumps({"type": "sync_request"})
+MSG_RATE_LIMITED = _dumps({"type": "error", "message": "Trop de messages, ralentissez."})
+MSG_INVALID_JSON = _dumps({"type": "error", "message": "Message JSON invalide"})
+MSG_ALREADY_IN_GAME = _dumps({"type": "error", "message": "Vous êtes déjà dans une partie."})
+MSG_NOT_YOUR_TURN = _dumps({"type": "error", "message": "Ce n'est pas votre tour."})
+MSG_ROOM_NOT_FOUND = _dumps({"type": "error", "message": "Salon introuvable"})
+MSG_ROOM_FULL = _dumps({"type": "error", "message": "Le salon est complet"})
+MSG_OWN_ROOM = _dumps({"type": "error", "message": "Vous ne pouvez pas rejoindre votre propre salon."})
+MSG_RECONNECT_NO_SLOT = _dumps({"type": "reconnect_failed", "reason": "Color slot not found"})
+MSG_RECONNECT_NO_ROOM = _dumps({"type": "reconnect_failed", "reason": "Room not found"})
+
 
 # --- Database Abstraction ---
 _use_postgres = bool(DATABASE_URL)
@@ -43,26 +100,46 @@ if CHESS_REQUIRE_DATABASE and not _use_postgres:
 if _use_postgres:
     import psycopg2
     import psycopg2.extras
-    print(f"[DB] Using PostgreSQL")
+    logger.info("[DB] Using PostgreSQL")
 else:
     import sqlite3
-    print("[DB] Using SQLite")
+    logger.info("[DB] Using SQLite")
 
 _DB_PATH = Path(CHESS_DB_PATH) if CHESS_DB_PATH else (Path(__file__).parent / "chess_users.db")
 if not _use_postgres:
     _DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    print(f"[DB] SQLite path: {_DB_PATH}")
+    logger.info("[DB] SQLite path: %s", _DB_PATH)
+
+
+# SQLite: one shared autocommit connection (WAL, synchronous=NORMAL) instead
+# of a connect + close per call. Its statements still run one at a time on
+# SQLite's connection mutex, reads included; _db_write_lock additionally
+# keeps a write and its commit together.
+# PostgreSQL: a connection per call, no process-side lock needed.
+_sqlite_conn = None
+_db_write_lock = contextlib.nullcontext() if _use_postgres else threading.Lock()
 
 
 def get_db():
-    """Get a database connection (PostgreSQL or SQLite)."""
+    """Get a database connection (PostgreSQL or SQLite). Hand it back with release_db()."""
+    global _sqlite_conn
     if _use_postgres:
         conn = psycopg2.connect(DATABASE_URL)
         conn.autocommit = False
         return conn
-    else:
-        conn = sqlite3.connect(_DB_PATH)
-        return conn
+    if _sqlite_conn is None:
+        conn = sqlite3.connect(_DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Per-connection setting: with WAL, NORMAL only fsyncs at checkpoints
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _sqlite_conn = conn
+    return _sqlite_conn
+
+
+def release_db(conn):
+    """Close a PostgreSQL connection; the shared SQLite connection stays open."""
+    if _use_postgres:
+        conn.close()
 
 
 def _ph(index=1):
@@ -75,6 +152,28 @@ def _P(*args):
     return args
 
 
+# Both players' stats in a single statement, kept as constant SQL text so the
+# driver's statement cache reuses the prepared statement.
+# Params: (winner, loser, is_draw, white, black) — winner/loser are None on a draw.
+SQL_RECORD_RESULT = f"""
+    UPDATE users SET
+        wins = wins + CASE WHEN username = {_ph()} THEN 1 ELSE 0 END,
+        losses = losses + CASE WHEN username = {_ph()} THEN 1 ELSE 0 END,
+        draws = draws + CASE WHEN {_ph()} THEN 1 ELSE 0 END
+    WHERE username IN ({_ph()}, {_ph()})
+"""
+
+# Case-insensitive username match that stays on an index: the SQLite column
+# is COLLATE NOCASE, PostgreSQL has the LOWER(username) unique index.
+_USERNAME_EQ = (
+    f"LOWER(username) = LOWER({_ph()})" if _use_postgres else f"username = {_ph()}"
+)
+SQL_USER_BY_NAME = f"SELECT username, wins, losses, draws FROM users WHERE {_USERNAME_EQ}"
+SQL_LOGIN_BY_NAME = (
+    f"SELECT username, wins, losses, draws, password_hash, salt FROM users WHERE {_USERNAME_EQ}"
+)
+
+
 def init_db():
     """Initialize database tables."""
     conn = get_db()
@@ -85,12 +184,15 @@ def init_db():
                 id SERIAL PRIMARY KEY,
                 username TEXT UNIQUE NOT NULL,
                 password_hash TEXT NOT NULL,
+                salt TEXT,
                 created_at TIMESTAMP DEFAULT NOW(),
                 wins INTEGER DEFAULT 0,
                 losses INTEGER DEFAULT 0,
                 draws INTEGER DEFAULT 0
             )
         """)
+        # Tables created before salted hashes existed
+        cur.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS salt TEXT")
         # Case-insensitive unique index for usernames
         cur.execute("""
             CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_lower
@@ -109,6 +211,7 @@ def init_db():
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE NOT NULL COLLATE NOCASE,
                 password_hash TEXT NOT NULL,
+                salt TEXT,
                 created_at TEXT DEFAULT (datetime('now')),
                 wins INTEGER DEFAULT 0,
                 losses INTEGER DEFAULT 0,
@@ -122,78 +225,150 @@ def init_db():
                 created_at TEXT DEFAULT (datetime('now'))
             )
         """)
+        cur.execute("PRAGMA table_info(users)")
+        if 'salt' not in {col[1] for col in cur.fetchall()}:
+            cur.execute("ALTER TABLE users ADD COLUMN salt TEXT")
+    # Leaderboard order, so the ranking's LIMIT 100 reads the index instead of sorting every user
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_ranking
+        ON users (wins DESC, losses ASC, created_at ASC)
+    """)
     conn.commit()
     cur.close()
-    conn.close()
-    print("[DB] Database tables initialized")
+    release_db(conn)
+    logger.info("[DB] Database tables initialized")
+
+
+# scrypt cost: ~16 MiB and a few tens of ms per hash. Hashes run on their own
+# small pool, not the default to_thread executor: a login/register burst then
+# holds at most HASH_WORKERS * 16 MiB and can't starve the DB lookups.
+SCRYPT_N = 16384
+SCRYPT_R = 8
+SCRYPT_P = 1
+HASH_WORKERS = 2
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="scrypt")
+# Hashed when the username doesn't exist, so a miss costs as much as a check
+_DUMMY_SALT = secrets.token_bytes(16)
 
 
-def hash_password(password: str) -> str:
+def hash_password(password: str, salt: bytes) -> str:
+    return hashlib.scrypt(
+        password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P
+    ).hex()
+
+
+async def hash_password_async(password: str, salt: bytes) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, hash_password, password, salt)
+
+
+def legacy_hash_password(password: str) -> str:
+    """Unsalted SHA-256 used by accounts created before scrypt; upgraded on login."""
     return hashlib.sha256(password.encode('utf-8')).hexdigest()
 
 
 # --- Token helpers (DB-backed, survive restarts) ---
+# Recently used tokens are also kept in a bounded LRU (token -> username),
+# so verify-token / game-result usually skip the query. Helpers run in
+# worker threads, hence the lock.
+TOKEN_CACHE_SIZE = 10_000
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
+def _cache_token(token, username):
+    with _token_cache_lock:
+        _token_cache[token] = username
+        _token_cache.move_to_end(token)
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
 
 def store_token(token: str, username: str):
     """Store an auth token in the database."""
     conn = get_db()
     try:
         p = _ph()
-        conn.cursor().execute(
-            f"INSERT INTO auth_tokens (token, username) VALUES ({p}, {p})",
-            (token, username)
-        )
-        conn.commit()
+        with _db_write_lock:
+            conn.cursor().execute(
+                f"INSERT INTO auth_tokens (token, username) VALUES ({p}, {p})",
+                (token, username)
+            )
+            conn.commit()
+        _cache_token(token, username)
     except Exception:
         conn.rollback()
     finally:
-        conn.close()
+        release_db(conn)
 
 
 def lookup_token(token: str):
     """Look up a token and return the username, or None."""
+    with _token_cache_lock:
+        username = _token_cache.get(token)
+        if username is not None:
+            _token_cache.move_to_end(token)
+            return username
     conn = get_db()
     try:
         p = _ph()
         cur = conn.cursor()
         cur.execute(f"SELECT username FROM auth_tokens WHERE token = {p}", (token,))
         row = cur.fetchone()
-        return row[0] if row else None
     finally:
-        conn.close()
+        release_db(conn)
+    if not row:
+        return None
+    _cache_token(token, row[0])
+    return row[0]
 
 
 def delete_token(token: str):
     """Remove an auth token."""
+    with _token_cache_lock:
+        _token_cache.pop(token, None)
     conn = get_db()
     try:
         p = _ph()
-        conn.cursor().execute(f"DELETE FROM auth_tokens WHERE token = {p}", (token,))
-        conn.commit()
+        with _db_write_lock:
+            conn.cursor().execute(f"DELETE FROM auth_tokens WHERE token = {p}", (token,))
+            conn.commit()
     except Exception:
         conn.rollback()
     finally:
-        conn.close()
+        release_db(conn)
 
 
 # --- Rooms ---
 rooms = {}  # room_id -> Room
+ws_to_room = {}  # ws -> started Room it plays in (reverse index of rooms)
 
 # --- Matchmaking Queue ---
-# time_limit -> list of (ws, asyncio.Future)
+# time_limit -> deque of (ws, asyncio.Future), oldest first
 matchmaking_queue = {}
-matchmaking_lock = asyncio.Lock()
-
+matchmaking_entries = {}  # ws -> (time_limit, future) of its queued entry
+# Only mutated from the event loop with no await in between, so no lock
 
 # --- Player usernames ---
 player_names = {}  # ws -> username string
+player_names_lc = {}  # ws -> casefolded username, for same-user checks
 
 # --- Track which room each username is in (prevent multi-room & self-play) ---
 player_rooms = {}  # username -> room_id
 
-# --- Track completed games to prevent duplicate result submissions ---
-# room_id -> { 'white': username, 'black': username, 'result': 'white'|'black'|'draw', 'reported_by': set }
-completed_games = {}
+
+def _leave_matchmaking(ws):
+    """Remove ws from the matchmaking queue it is waiting in, if any."""
+    entry = matchmaking_entries.pop(ws, None)
+    if entry is None:
+        return
+    time_limit, future = entry
+    queue = matchmaking_queue.get(time_limit)
+    if queue is not None:
+        try:
+            queue.remove((ws, future))
+        except ValueError:
+            pass
 
 
 def get_username_for_ws(ws):
@@ -201,20 +376,32 @@ def get_username_for_ws(ws):
     return player_names.get(ws)
 
 
+# Turn state as ints so a move flips it with one XOR
+WHITE, BLACK = 0, 1
+
+
 class Room:
     """Représente un salon de jeu avec deux joueurs."""
+    __slots__ = (
+        "room_id", "players", "host", "guest", "white_ws", "black_ws", "started", "time_limit",
+        "move_count", "current_turn", "game_over", "result_recorded", "player_usernames",
+    )
+
     def __init__(self, room_id, host_ws, time_limit=300):
         self.room_id = room_id
         self.players = {host_ws: None}  # ws -> color
         self.host = host_ws
         self.guest = None
+        self.white_ws = None  # set by assign_colors, kept in sync with players
+        self.black_ws = None
         self.started = False
         self.time_limit = time_limit  # 0 = sans timer
         # Anti-cheat state
         self.move_count = 0           # total moves played
-        self.current_turn = 'white'   # whose turn it is
+        self.current_turn = WHITE     # whose turn it is (WHITE / BLACK)
         self.game_over = False        # server-side game-over flag
         self.result_recorded = False  # prevent duplicate stat writes
+        self.player_usernames = ()    # (white, black) names captured at game start
 
     def is_full(self):
         return len(self.players) == 2
@@ -232,54 +419,87 @@ class Room:
 
     def assign_colors(self):
         """Assigne aléatoirement blanc/noir aux deux joueurs."""
-        if random.random() < 0.5:
-            self.players[self.host] = "white"
-            self.players[self.guest] = "black"
+        if random.getrandbits(1):
+            self.white_ws, self.black_ws = self.host, self.guest
         else:
-            self.players[self.host] = "black"
-            self.players[self.guest] = "white"
+            self.white_ws, self.black_ws = self.guest, self.host
+        self.players[self.white_ws] = "white"
+        self.players[self.black_ws] = "black"
+        self.player_usernames = (player_names.get(self.white_ws), player_names.get(self.black_ws))
         self.started = True
-        self.current_turn = 'white'
+        self.current_turn = WHITE
         self.move_count = 0
+        ws_to_room[self.host] = self
+        ws_to_room[self.guest] = self
 
     def get_opponent(self, ws):
-        for player in self.players:
-            if player != ws:
-                return player
+        if ws is self.white_ws:
+            return self.black_ws
+        if ws is self.black_ws:
+            return self.white_ws
         return None
 
     def get_color(self, ws):
         return self.players.get(ws)
 
     def get_ws_for_color(self, color):
-        for ws, c in self.players.items():
-            if c == color:
-                return ws
+        if color == "white":
+            return self.white_ws
+        if color == "black":
+            return self.black_ws
         return None
 
     def remove_player(self, ws):
         if ws in self.players:
             del self.players[ws]
+        if ws is self.white_ws:
+            self.white_ws = None
+        elif ws is self.black_ws:
+            self.black_ws = None
+        ws_to_room.pop(ws, None)
+
+    def replace_player(self, old_ws, new_ws):
+        """Swap a player's websocket (reconnection), keeping the same color."""
+        self.players[new_ws] = self.players.pop(old_ws)
+        if self.host == old_ws:
+            self.host = new_ws
+        if self.guest == old_ws:
+            self.guest = new_ws
+        if self.white_ws is old_ws:
+            self.white_ws = new_ws
+        elif self.black_ws is old_ws:
+            self.black_ws = new_ws
+        ws_to_room.pop(old_ws, None)
+        if self.started:
+            ws_to_room[new_ws] = self
 
     def advance_turn(self):
         """Switch turn after a valid move."""
         self.move_count += 1
-        self.current_turn = 'black' if self.current_turn == 'white' else 'white'
+        self.current_turn ^= 1
 
     def is_players_turn(self, ws):
         """Check if it's this player's turn."""
-        return self.get_color(ws) == self.current_turn
+        return ws is (self.black_ws if self.current_turn else self.white_ws)
+
+    def release_player_rooms(self):
+        """Free both players' player_rooms slots, if they still point here."""
+        for name in self.player_usernames:
+            if name and player_rooms.get(name) == self.room_id:
+                del player_rooms[name]
 
     def get_usernames(self):
         """Return dict {color: username}."""
         result = {}
-        for ws, color in self.players.items():
-            if color:
-                result[color] = player_names.get(ws)
+        if self.white_ws is not None:
+            result["white"] = player_names.get(self.white_ws)
+        if self.black_ws is not None:
+            result["black"] = player_names.get(self.black_ws)
         return result
 
-    def record_result(self, winner_color):
-        """Record game result server-side. winner_color is 'white', 'black', or None (draw)."""
+    async def record_result(self, winner_color):
+        """Record game result server-side. winner_color is 'white', 'black', or None (draw).
+        The flags flip immediately; the DB write runs in a worker thread."""
         if self.result_recorded:
             return
         self.result_recorded = True
@@ -292,178 +512,278 @@ class Room:
         if not white_user or not black_user:
             return
 
-        conn = get_db()
-        p = _ph()
-        try:
-            cur = conn.cursor()
-            if winner_color is None:
-                cur.execute(f"UPDATE users SET draws = draws + 1 WHERE username = {p}", (white_user,))
-                cur.execute(f"UPDATE users SET draws = draws + 1 WHERE username = {p}", (black_user,))
-            elif winner_color == 'white':
-                cur.execute(f"UPDATE users SET wins = wins + 1 WHERE username = {p}", (white_user,))
-                cur.execute(f"UPDATE users SET losses = losses + 1 WHERE username = {p}", (black_user,))
-            elif winner_color == 'black':
-                cur.execute(f"UPDATE users SET wins = wins + 1 WHERE username = {p}", (black_user,))
-                cur.execute(f"UPDATE users SET losses = losses + 1 WHERE username = {p}", (white_user,))
+        await asyncio.to_thread(_store_result, winner_color, white_user, black_user)
+        logger.info("[GAME] Result recorded: room=%s winner=%s white=%s black=%s",
+                    self.room_id, winner_color, white_user, black_user)
+
+
+def _store_result(winner_color, white_user, black_user):
+    """Apply one finished game to both players' stats."""
+    if winner_color == 'white':
+        winner, loser = white_user, black_user
+    elif winner_color == 'black':
+        winner, loser = black_user, white_user
+    else:
+        winner = loser = None
+
+    conn = get_db()
+    try:
+        with _db_write_lock:
+            conn.cursor().execute(
+                SQL_RECORD_RESULT,
+                (winner, loser, winner_color is None, white_user, black_user)
+            )
             conn.commit()
-        except Exception as e:
-            conn.rollback()
-            print(f"[DB] Error recording result: {e}")
-        finally:
-            conn.close()
-        print(f"[GAME] Result recorded: room={self.room_id} winner={winner_color} "
-              f"white={white_user} black={black_user}")
+        _ranking_cache['ts'] = 0.0
+    except Exception as e:
+        conn.rollback()
+        logger.error("[DB] Error recording result: %s", e)
+    finally:
+        release_db(conn)
+
+
+# Room codes are base32 (A-Z, 2-7): 5 chars = 25 random bits each
+ROOM_ID_LENGTH = 5
+_ROOM_ID_CANDIDATES = 4  # candidates drawn per attempt
+_ROOM_ID_BYTES = 15      # -> 24 base32 chars, enough for the 4 candidates
 
 
 def generate_room_id():
-    """Génère un code de salon court et lisible."""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
+    """Génère un code de salon court, lisible et pas encore utilisé."""
+    while True:
+        chars = base64.b32encode(os.urandom(_ROOM_ID_BYTES)).decode('ascii')
+        for i in range(0, ROOM_ID_LENGTH * _ROOM_ID_CANDIDATES, ROOM_ID_LENGTH):
+            room_id = chars[i:i + ROOM_ID_LENGTH]
+            if room_id not in rooms:
+                return room_id
+
+
+def normalize_room_id(raw):
+    """Return the canonical room code for a client-supplied id, or None if it
+    can't be one. Canonical ids (the common case) are returned as-is."""
+    if not isinstance(raw, str):
+        return None
+    if len(raw) != ROOM_ID_LENGTH:
+        raw = raw.strip()
+        if len(raw) != ROOM_ID_LENGTH:
+            return None
+    if not (raw.isascii() and raw.isalnum()):
+        return None
+    return raw if raw.isupper() else raw.upper()
 
 
 def find_room_for_ws(ws):
     """Find the active room that this ws belongs to."""
-    for room in rooms.values():
-        if ws in room.players and room.started:
-            return room
-    return None
+    return ws_to_room.get(ws)
 
 
-# --- Auth & Ranking handlers ---
+def drop_room(room):
+    """Forget a room and its reverse-index entries."""
+    rooms.pop(room.room_id, None)
+    for p_ws in room.players:
+        ws_to_room.pop(p_ws, None)
 
-async def register_handler(request):
-    try:
-        data = await request.json()
-    except Exception:
-        return web.json_response({'error': 'JSON invalide'}, status=400)
 
-    username = data.get('username', '').strip()
-    password = data.get('password', '').strip()
+# --- Auth & Ranking handlers ---
+# DB work runs in plain functions called through asyncio.to_thread, so the
+# event loop keeps serving websockets while a query (or hash) is running.
 
-    if len(username) < 2 or len(username) > 20:
-        return web.json_response({'error': 'Pseudo : 2 à 20 caractères'}, status=400)
-    if not all(c.isalnum() or c in '-_' for c in username):
-        return web.json_response({'error': 'Pseudo : lettres, chiffres, - et _ uniquement'}, status=400)
-    if len(password) < 4:
-        return web.json_response({'error': 'Mot de passe : 4 caractères minimum'}, status=400)
+# Letters (Unicode, as str.isalnum allowed), digits, - and _; 2 to 20 chars
+_USERNAME_RE = re.compile(r'[\w-]{2,20}')
 
-    pw_hash = hash_password(password)
+
+def _fetch_user(username):
+    """Return (username, wins, losses, draws) for an exact username, or None."""
     conn = get_db()
     p = _ph()
     try:
         cur = conn.cursor()
         cur.execute(
-            f"INSERT INTO users (username, password_hash) VALUES ({p}, {p})",
-            (username, pw_hash)
-        )
-        conn.commit()
-        cur.execute(
-            f"SELECT username, wins, losses, draws FROM users WHERE LOWER(username) = LOWER({p})",
+            f"SELECT username, wins, losses, draws FROM users WHERE username = {p}",
             (username,)
         )
-        row = cur.fetchone()
+        return cur.fetchone()
+    finally:
+        release_db(conn)
+
+
+def _do_register(username, pw_hash, salt_hex):
+    """Create a user and return its row, or None if the name is taken."""
+    conn = get_db()
+    p = _ph()
+    try:
+        cur = conn.cursor()
+        with _db_write_lock:
+            cur.execute(
+                f"INSERT INTO users (username, password_hash, salt) VALUES ({p}, {p}, {p})",
+                (username, pw_hash, salt_hex)
+            )
+            conn.commit()
+        cur.execute(SQL_USER_BY_NAME, (username,))
+        return cur.fetchone()
     except Exception as e:
         conn.rollback()
         err_str = str(e).lower()
         if 'unique' in err_str or 'duplicate' in err_str or 'integrity' in err_str:
-            return web.json_response({'error': 'Ce pseudo est déjà pris'}, status=409)
+            return None
         raise
     finally:
-        conn.close()
+        release_db(conn)
+
+
+def _fetch_login_row(username):
+    """Return (username, wins, losses, draws, password_hash, salt) or None."""
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute(SQL_LOGIN_BY_NAME, (username,))
+        return cur.fetchone()
+    finally:
+        release_db(conn)
+
+
+def _store_password(username, pw_hash, salt_hex):
+    conn = get_db()
+    p = _ph()
+    try:
+        with _db_write_lock:
+            conn.cursor().execute(
+                f"UPDATE users SET password_hash = {p}, salt = {p} WHERE username = {p}",
+                (pw_hash, salt_hex, username)
+            )
+            conn.commit()
+    finally:
+        release_db(conn)
+
+
+async def _do_login(username, password):
+    """Return the user's row if the credentials match, else None."""
+    row = await asyncio.to_thread(_fetch_login_row, username)
+    if not row:
+        await hash_password_async(password, _DUMMY_SALT)
+        return None
+    stored_hash, salt_hex = row[4], row[5]
+    if salt_hex:
+        candidate = await hash_password_async(password, bytes.fromhex(salt_hex))
+    else:
+        candidate = legacy_hash_password(password)
+    if not hmac.compare_digest(candidate, stored_hash):
+        return None
+    if not salt_hex:
+        # Re-hash legacy accounts with scrypt now that we know the password
+        salt = secrets.token_bytes(16)
+        pw_hash = await hash_password_async(password, salt)
+        await asyncio.to_thread(_store_password, row[0], pw_hash, salt.hex())
+    return row[:4]
+
+
+# Encoded /api/ranking body, rebuilt at most every RANKING_CACHE_TTL seconds
+# and dropped whenever a game result is stored
+RANKING_CACHE_TTL = 5
+_ranking_cache = {'bytes': None, 'ts': 0.0}
+
+
+def _fetch_ranking():
+    conn = get_db()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT username, wins, losses, draws,
+                   (wins + losses + draws) AS games
+            FROM users
+            ORDER BY wins DESC, losses ASC, created_at ASC
+            LIMIT 100
+        """)
+        return cur.fetchall()
+    finally:
+        release_db(conn)
+
+
+async def register_handler(request):
+    try:
+        data = _loads(await request.read())
+    except Exception:
+        return web.json_response({'error': 'JSON invalide'}, status=400, dumps=_dumps)
+
+    username = data.get('username', '').strip()
+    password = data.get('password', '').strip()
+
+    if not _USERNAME_RE.fullmatch(username):
+        if len(username) < 2 or len(username) > 20:
+            return web.json_response({'error': 'Pseudo : 2 à 20 caractères'}, status=400, dumps=_dumps)
+        return web.json_response({'error': 'Pseudo : lettres, chiffres, - et _ uniquement'}, status=400, dumps=_dumps)
+    if len(password) < 4:
+        return web.json_response({'error': 'Mot de passe : 4 caractères minimum'}, status=400, dumps=_dumps)
+
+    salt = secrets.token_bytes(16)
+    pw_hash = await hash_password_async(password, salt)
+    row = await asyncio.to_thread(_do_register, username, pw_hash, salt.hex())
+    if row is None:
+        return web.json_response({'error': 'Ce pseudo est déjà pris'}, status=409, dumps=_dumps)
 
     token = secrets.token_hex(32)
-    store_token(token, row[0])
+    await asyncio.to_thread(store_token, token, row[0])
     return web.json_response({
         'token': token, 'username': row[0],
         'wins': row[1], 'losses': row[2], 'draws': row[3]
-    })
+    }, dumps=_dumps)
 
 
 async def login_handler(request):
     try:
-        data = await request.json()
+        data = _loads(await request.read())
     except Exception:
-        return web.json_response({'error': 'JSON invalide'}, status=400)
+        return web.json_response({'error': 'JSON invalide'}, status=400, dumps=_dumps)
 
     username = data.get('username', '').strip()
     password = data.get('password', '').strip()
-    pw_hash = hash_password(password)
-
-    conn = get_db()
-    p = _ph()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            f"SELECT username, wins, losses, draws FROM users WHERE LOWER(username) = LOWER({p}) AND password_hash = {p}",
-            (username, pw_hash)
-        )
-        row = cur.fetchone()
-    finally:
-        conn.close()
 
+    row = await _do_login(username, password)
     if not row:
-        return web.json_response({'error': 'Identifiants incorrects'}, status=401)
+        return web.json_response({'error': 'Identifiants incorrects'}, status=401, dumps=_dumps)
 
     token = secrets.token_hex(32)
-    store_token(token, row[0])
+    await asyncio.to_thread(store_token, token, row[0])
     return web.json_response({
         'token': token, 'username': row[0],
         'wins': row[1], 'losses': row[2], 'draws': row[3]
-    })
+    }, dumps=_dumps)
 
 
 async def verify_token_handler(request):
     try:
-        data = await request.json()
+        data = _loads(await request.read())
     except Exception:
-        return web.json_response({'error': 'JSON invalide'}, status=400)
+        return web.json_response({'error': 'JSON invalide'}, status=400, dumps=_dumps)
 
     token = data.get('token', '').strip()
-    username = lookup_token(token)
+    username = await asyncio.to_thread(lookup_token, token)
 
     if not username:
-        return web.json_response({'error': 'Token invalide'}, status=401)
-
-    conn = get_db()
-    p = _ph()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            f"SELECT username, wins, losses, draws FROM users WHERE username = {p}",
-            (username,)
-        )
-        row = cur.fetchone()
-    finally:
-        conn.close()
+        return web.json_response({'error': 'Token invalide'}, status=401, dumps=_dumps)
 
+    row = await asyncio.to_thread(_fetch_user, username)
     if not row:
-        delete_token(token)
-        return web.json_response({'error': 'Utilisateur introuvable'}, status=404)
+        await asyncio.to_thread(delete_token, token)
+        return web.json_response({'error': 'Utilisateur introuvable'}, status=404, dumps=_dumps)
 
     return web.json_response({
         'username': row[0], 'wins': row[1], 'losses': row[2], 'draws': row[3]
-    })
+    }, dumps=_dumps)
 
 
 async def ranking_handler(request):
-    conn = get_db()
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT username, wins, losses, draws,
-                   (wins + losses + draws) AS games
-            FROM users
-            ORDER BY wins DESC, losses ASC, created_at ASC
-            LIMIT 100
-        """)
-        rows = cur.fetchall()
-    finally:
-        conn.close()
-
-    ranking = [
-        {'rank': i + 1, 'username': r[0], 'wins': r[1], 'losses': r[2], 'draws': r[3], 'games': r[4]}
-        for i, r in enumerate(rows)
-    ]
-    return web.json_response({'ranking': ranking})
+    body = _ranking_cache['bytes']
+    if body is None or time.monotonic() - _ranking_cache['ts'] >= RANKING_CACHE_TTL:
+        rows = await asyncio.to_thread(_fetch_ranking)
+        ranking = [
+            {'rank': i + 1, 'username': r[0], 'wins': r[1], 'losses': r[2], 'draws': r[3], 'games': r[4]}
+            for i, r in enumerate(rows)
+        ]
+        body = orjson.dumps({'ranking': ranking})
+        _ranking_cache['bytes'] = body
+        _ranking_cache['ts'] = time.monotonic()
+    return web.Response(body=body, content_type='application/json')
 
 
 async def game_result_handler(request):
@@ -471,518 +791,543 @@ async def game_result_handler(request):
     Results are now recorded server-side only."""
     auth_header = request.headers.get('Authorization', '')
     token = auth_header.replace('Bearer ', '').strip()
-    username = lookup_token(token)
+    username = await asyncio.to_thread(lookup_token, token)
 
     if not username:
-        return web.json_response({'error': 'Non authentifié'}, status=401)
-
-    conn = get_db()
-    p = _ph()
-    try:
-        cur = conn.cursor()
-        cur.execute(
-            f"SELECT wins, losses, draws FROM users WHERE username = {p}",
-            (username,)
-        )
-        row = cur.fetchone()
-    finally:
-        conn.close()
+        return web.json_response({'error': 'Non authentifié'}, status=401, dumps=_dumps)
 
+    row = await asyncio.to_thread(_fetch_user, username)
     if not row:
-        return web.json_response({'error': 'Utilisateur introuvable'}, status=404)
+        return web.json_response({'error': 'Utilisateur introuvable'}, status=404, dumps=_dumps)
 
-    return web.json_response({'wins': row[0], 'losses': row[1], 'draws': row[2]})
+    return web.json_response({'wins': row[1], 'losses': row[2], 'draws': row[3]}, dumps=_dumps)
 
 
 # --- WebSocket handler ---
+def _relax_write_buffer(request):
+    """Raise the transport high-water mark so bursts of moves / sync_state
+    don't force a drain on every send. Only applied to players in a room,
+    unauthenticated sockets keep the default back-pressure."""
+    transport = request.transport
+    if transport is None:
+        return
+    try:
+        transport.set_write_buffer_limits(high=WS_WRITE_BUFFER_HIGH)
+    except (AttributeError, NotImplementedError):
+        pass
+
+
+# Every outbound frame goes through a per-connection outbox drained by that
+# connection's writer task, so producers (a move relay, the reaper, the
+# other player's handler) never wait on a slow client's socket. Frames for
+# one connection keep their order.
+ws_outboxes = {}  # ws -> asyncio.Queue of pre-encoded payloads
+
+
+def _send(ws, data):
+    """Queue a pre-encoded payload for ws; returns immediately. Gone peers are
+    skipped. A peer whose outbox is full is closed rather than losing frames
+    (a dropped move would desync the game): it reconnects and resyncs."""
+    if ws is None or ws.closed:
+        return
+    outbox = ws_outboxes.get(ws)
+    if outbox is None:
+        return
+    try:
+        outbox.put_nowait(data)
+    except asyncio.QueueFull:
+        del ws_outboxes[ws]
+        logger.warning("[WS] Outbox full (%d frames), closing slow connection", WS_OUTBOX_SIZE)
+        _fire(ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"Too slow"))
+
+
+async def _ws_writer(ws, outbox):
+    """Drain one connection's outbox until the socket goes away."""
+    while True:
+        data = await outbox.get()
+        try:
+            await ws.send_str(data)
+        except ConnectionError:
+            return
+
+
+# The loop only keeps weak references to tasks: hold fire-and-forget ones
+# here until they finish so they can't be collected mid-flight.
+_background_tasks = set()
+
+
+def _fire(coro):
+    """Run socket work nobody should wait on (closing a stuck peer) in its
+    own task."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_log_send_failure)
+    return task
+
+
+def _log_send_failure(task):
+    _background_tasks.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    # A peer that went away is expected, anything else is worth a line
+    if exc is not None and not isinstance(exc, ConnectionError):
+        logger.warning("[WS] Background task failed: %r", exc)
+
+
+class Session:
+    """État d'une connexion WebSocket, partagé par les handlers de messages."""
+    __slots__ = (
+        "ws", "current_room", "in_matchmaking", "write_buffer_relaxed",
+        "msg_timestamps", "writer",
+    )
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.current_room = None
+        self.in_matchmaking = False
+        self.write_buffer_relaxed = False
+        self.msg_timestamps = deque()  # rate limiting: timestamps of recent messages, oldest first
+        outbox = ws_outboxes[ws] = asyncio.Queue(maxsize=WS_OUTBOX_SIZE)
+        self.writer = asyncio.create_task(_ws_writer(ws, outbox))
+
+    def active_room(self):
+        """Return (room, opponent ws) for this player, resolved once per message.
+        Falls back to a lookup if the connection lost track of its room."""
+        room = self.current_room or find_room_for_ws(self.ws)
+        if not room:
+            return None, None
+        self.current_room = room
+        return room, room.get_opponent(self.ws)
+
+
+def _send_game_start(room, matchmade=False):
+    """Tell both players the game started. Each payload (color and opponent
+    name differ) is encoded once, then queued on that player's outbox."""
+    base = {"type": "game_start", "room_id": room.room_id, "time": room.time_limit}
+    if matchmade:
+        base["matchmade"] = True
+    payloads = [
+        (player_ws, _dumps({
+            **base,
+            "color": color,
+            "opponent_name": room.get_opponent_name(player_ws),
+        }))
+        for player_ws, color in room.players.items()
+    ]
+    for p_ws, data in payloads:
+        _send(p_ws, data)
+
+
+async def _handle_set_username(session, msg):
+    name = msg.get("username", "").strip()[:20]
+    if name:
+        player_names[session.ws] = name
+        player_names_lc[session.ws] = name.casefold()
+
+
+async def _handle_create_room(session, msg):
+    ws = session.ws
+    my_name = get_username_for_ws(ws)
+
+    # Block if already in an active room
+    if my_name and my_name in player_rooms:
+        _send(ws, MSG_ALREADY_IN_GAME)
+        return
+
+    room_id = generate_room_id()
+
+    time_limit = msg.get("time", 300)
+    # Validate time_limit
+    if time_limit not in (0, 60, 180, 300, 600, 900, 1800):
+        time_limit = 300
+
+    room = Room(room_id, ws, time_limit)
+    rooms[room_id] = room
+    session.current_room = room
+
+    if my_name:
+        player_rooms[my_name] = room_id
+
+    _send(ws, _dumps({
+        "type": "room_created",
+        "room_id": room_id
+    }))
+
+
+async def _handle_join_room(session, msg):
+    ws = session.ws
+    room_id = normalize_room_id(msg.get("room_id"))
+    if room_id is None:
+        _send(ws, MSG_ROOM_NOT_FOUND)
+        return
+
+    if room_id not in rooms:
+        _send(ws, _dumps({
+            "type": "error",
+            "message": f"Salon '{room_id}' introuvable"
+        }))
+        return
+
+    room = rooms[room_id]
+    if room.is_full():
+        _send(ws, MSG_ROOM_FULL)
+        return
+
+    # --- Prevent self-play: same username can't be host and guest ---
+    my_name = get_username_for_ws(ws)
+    my_name_lc = player_names_lc.get(ws)
+    if my_name_lc and my_name_lc == player_names_lc.get(room.host):
+        _send(ws, MSG_OWN_ROOM)
+        return
+
+    # Block if already in an active room
+    if my_name and my_name in player_rooms:
+        _send(ws, MSG_ALREADY_IN_GAME)
+        return
+
+    room.add_guest(ws)
+    session.current_room = room
+    room.assign_colors()
+
+    if my_name:
+        player_rooms[my_name] = room_id
+
+    _send_game_start(room)
+
+
+async def _handle_matchmaking_join(session, msg):
+    ws = session.ws
+    my_name = get_username_for_ws(ws)
+    my_name_lc = player_names_lc.get(ws)
+
+    # Block if already in an active room
+    if my_name and my_name in player_rooms:
+        _send(ws, MSG_ALREADY_IN_GAME)
+        return
+
+    time_limit = msg.get("time", 300)
+    if time_limit not in (0, 60, 180, 300, 600, 900, 1800):
+        time_limit = 300
+    session.in_matchmaking = True
+
+    # The queue is only touched from the event loop and the section below
+    # has no await, so it runs atomically: no lock. Sends happen after it.
+    # A second join replaces any entry we already have
+    _leave_matchmaking(ws)
+    queue = matchmaking_queue.setdefault(time_limit, deque())
+
+    # Pop from the front until a valid opponent shows up: stale
+    # entries (closed connections) are dropped on the way,
+    # same-user entries are put back in their original order.
+    matched = False
+    skipped = []
+    while queue:
+        opp_ws, opp_future = queue.popleft()
+        if opp_ws.closed or opp_future.done():
+            matchmaking_entries.pop(opp_ws, None)
+            continue
+        # --- Prevent self-match: skip if same user (different tab / connection) ---
+        if my_name_lc and my_name_lc == player_names_lc.get(opp_ws):
+            skipped.append((opp_ws, opp_future))
+            continue
+
+        # Valid opponent found!
+        opp_name = get_username_for_ws(opp_ws)
+        matchmaking_entries.pop(opp_ws, None)
+        matched = True
+        break
+    queue.extendleft(reversed(skipped))
+
+    if not matched:
+        # No valid opponent — add self to queue
+        future = asyncio.get_running_loop().create_future()
+        queue.append((ws, future))
+        matchmaking_entries[ws] = (time_limit, future)
+        _send(ws, _dumps({
+            "type": "matchmaking_waiting",
+            "queue_size": len(queue)
+        }))
+        return
+
+    room_id = generate_room_id()
+
+    room = Room(room_id, opp_ws, time_limit)
+    room.add_guest(ws)
+    rooms[room_id] = room
+    session.current_room = room
+    room.assign_colors()
+    session.in_matchmaking = False
+
+    # Track rooms
+    if my_name:
+        player_rooms[my_name] = room_id
+    if opp_name:
+        player_rooms[opp_name] = room_id
+
+    if not opp_future.done():
+        opp_future.set_result(room)
+
+    _send_game_start(room, matchmade=True)
+
+
+async def _handle_matchmaking_cancel(session, msg):
+    session.in_matchmaking = False
+    _leave_matchmaking(session.ws)
+
+    _send(session.ws, MSG_MATCHMAKING_CANCELLED)
+
+
+async def _handle_ping(session, msg):
+    _send(session.ws, MSG_PONG)
+
+
+async def _handle_move(session, msg):
+    """Forward a move to the opponent, with turn validation."""
+    ws = session.ws
+    active, opponent = session.active_room()
+    if not active or active.game_over:
+        return
+
+    # Validate it's this player's turn
+    if not active.is_players_turn(ws):
+        _send(ws, MSG_NOT_YOUR_TURN)
+        return
+
+    # Validate move data: both squares need integer row/col within the board.
+    # OR-ing the four values leaves a bit above 7 set iff one of them is
+    # outside 0..7 (negative ints included); missing keys, non-dict squares
+    # and non-int values raise instead.
+    move_from = msg.get("from")
+    move_to = msg.get("to")
+    try:
+        if (move_from["row"] | move_from["col"] | move_to["row"] | move_to["col"]) & ~7:
+            return
+    except (KeyError, TypeError):
+        return
+
+    active.advance_turn()
+
+    if opponent and not opponent.closed:
+        move_msg = {
+            "type": "move",
+            "from": move_from,
+            "to": move_to,
+            "promotion": msg.get("promotion")
+        }
+        if "white_time" in msg:
+            move_msg["white_time"] = msg["white_time"]
+            move_msg["black_time"] = msg["black_time"]
+        _send(opponent, _dumps(move_msg))
+
+
+async def _handle_timeout(session, msg):
+    """Timeout claimed by a client — validate only the claimer's own timeout."""
+    active, opponent = session.active_room()
+    if not active or active.game_over:
+        return
+
+    loser = msg.get("loser", "")
+
+    # Only accept timeout if this player is reporting their OWN time running out
+    # OR if timer is enabled and they claim opponent's time ran out
+    # (both clients track the timer, accept from either)
+    if loser not in ("white", "black"):
+        return
+
+    winner = "black" if loser == "white" else "white"
+    active.game_over = True
+
+    if opponent and not opponent.closed:
+        _send(opponent, _dumps({
+            "type": "timeout",
+            "winner": winner
+        }))
+
+    # Record result server-side
+    await active.record_result(winner)
+
+    # Clean up player_rooms
+    active.release_player_rooms()
+
+
+async def _handle_resign(session, msg):
+    ws = session.ws
+    active, opponent = session.active_room()
+    if not active or active.game_over:
+        return
+
+    my_color = active.get_color(ws)
+    winner_color = "black" if my_color == "white" else "white"
+    active.game_over = True
+
+    _send(opponent, MSG_OPPONENT_RESIGNED)
+
+    # Record result server-side
+    await active.record_result(winner_color)
+
+    # Clean up player_rooms
+    active.release_player_rooms()
+
+
+async def _handle_game_end(session, msg):
+    """Game end (checkmate, stalemate, draw) — reported by client."""
+    active, _ = session.active_room()
+    if not active or active.game_over:
+        return
+
+    result = msg.get("result")  # 'checkmate', 'stalemate', 'draw'
+    winner = msg.get("winner")   # 'white', 'black', or None
+
+    if result in ("stalemate", "draw"):
+        await active.record_result(None)
+    elif result == "checkmate" and winner in ("white", "black"):
+        await active.record_result(winner)
+
+    # Clean up player_rooms
+    active.release_player_rooms()
+
+
+async def _handle_chat(session, msg):
+    """Forward a sanitized chat message."""
+    active, opponent = session.active_room()
+    if active:
+        chat_msg = msg.get("message", "")
+        # Sanitize: strip HTML tags, limit length
+        chat_msg = html_mod.escape(str(chat_msg)[:200])
+        if opponent and not opponent.closed:
+            _send(opponent, _dumps({
+                "type": "chat",
+                "message": chat_msg
+            }))
+
+
+async def _handle_reconnect(session, msg):
+    """Client tries to rejoin a room after connection drop."""
+    ws = session.ws
+    room_id = normalize_room_id(msg.get("room_id"))
+    color = msg.get("color")
+    if room_id in rooms:
+        room = rooms[room_id]
+        # Find the disconnected player slot and replace ws
+        old_ws = room.get_ws_for_color(color)
+        if old_ws:
+            # Swap ws reference
+            room.replace_player(old_ws, ws)
+            session.current_room = room
+            session.in_matchmaking = False
+            # Notify opponent about reconnection
+            opponent = room.get_opponent(ws)
+            _send(opponent, MSG_OPPONENT_RECONNECTED)
+            _send(ws, _dumps({
+                "type": "reconnected",
+                "room_id": room_id,
+                "color": color,
+                "time": room.time_limit
+            }))
+        else:
+            _send(ws, MSG_RECONNECT_NO_SLOT)
+    else:
+        _send(ws, MSG_RECONNECT_NO_ROOM)
+
+
+def _sync_from_ply(msg):
+    """Ply a resync starts from (moves the requester already has), 0 = full history."""
+    ply = msg.get("from_ply")
+    if type(ply) is not int or ply < 0:
+        return 0
+    return ply
+
+
+async def _handle_sync_request(session, msg):
+    """Opponent requests the moves it is missing (from from_ply on) to resync."""
+    active, opponent = session.active_room()
+    if active:
+        if opponent and not opponent.closed:
+            from_ply = _sync_from_ply(msg)
+            _send(
+                opponent,
+                _dumps({"type": "sync_request", "from_ply": from_ply})
+                if from_ply else MSG_SYNC_REQUEST
+            )
+
+
+async def _handle_sync_state(session, msg):
+    """Forward game state to opponent (for resync): moves from from_ply on."""
+    active, opponent = session.active_room()
+    if active:
+        if opponent and not opponent.closed:
+            _send(opponent, _dumps({
+                "type": "sync_state",
+                "from_ply": _sync_from_ply(msg),
+                "moves": msg.get("moves", []),
+                "white_time": msg.get("white_time"),
+                "black_time": msg.get("black_time")
+            }))
+
+
+# msg["type"] -> handler(session, msg)
+MESSAGE_HANDLERS = {
+    "set_username": _handle_set_username,
+    "create_room": _handle_create_room,
+    "join_room": _handle_join_room,
+    "matchmaking_join": _handle_matchmaking_join,
+    "matchmaking_cancel": _handle_matchmaking_cancel,
+    "ping": _handle_ping,
+    "move": _handle_move,
+    "timeout": _handle_timeout,
+    "resign": _handle_resign,
+    "game_end": _handle_game_end,
+    "chat": _handle_chat,
+    "reconnect": _handle_reconnect,
+    "sync_request": _handle_sync_request,
+    "sync_state": _handle_sync_state,
+}
+
+
 async def websocket_handler(request):
     """Gère la connexion WebSocket d'un joueur."""
     ws = web.WebSocketResponse(
         heartbeat=20,        # Server sends ping every 20s
         autoping=True,       # Auto-respond to client pings
+        max_msg_size=WS_MAX_MSG_SIZE,
     )
     await ws.prepare(request)
 
-    current_room = None
-    in_matchmaking = False
-    _msg_timestamps = []           # rate limiting: timestamps of recent messages
+    session = Session(ws)
     _MSG_RATE_LIMIT = 30           # max messages per window
     _MSG_RATE_WINDOW = 5           # window in seconds
+    loop = asyncio.get_running_loop()
+    timestamps = session.msg_timestamps
 
     try:
         async for raw_message in ws:
-            if raw_message.type == web.WSMsgType.TEXT:
+            # Clients send UTF-8 JSON as BINARY frames (no text validation
+            # pass); TEXT frames are still accepted from older clients.
+            if raw_message.type in (web.WSMsgType.BINARY, web.WSMsgType.TEXT):
 
                 # --- Rate limiting ---
-                now = asyncio.get_event_loop().time()
-                _msg_timestamps = [t for t in _msg_timestamps if now - t < _MSG_RATE_WINDOW]
-                if len(_msg_timestamps) >= _MSG_RATE_LIMIT:
-                    await ws.send_json({
-                        "type": "error",
-                        "message": "Trop de messages, ralentissez."
-                    })
-                    continue
-                _msg_timestamps.append(now)
-
-                try:
-                    msg = json.loads(raw_message.data)
-                except json.JSONDecodeError:
-                    await ws.send_json({
-                        "type": "error",
-                        "message": "Message JSON invalide"
-                    })
+                now = loop.time()
+                while timestamps and now - timestamps[0] >= _MSG_RATE_WINDOW:
+                    timestamps.popleft()
+                if len(timestamps) >= _MSG_RATE_LIMIT:
+                    _send(ws, MSG_RATE_LIMITED)
                     continue
+                timestamps.append(now)
 
-                msg_type = msg.get("type")
+                if not session.write_buffer_relaxed and session.current_room is not None:
+                    _relax_write_buffer(request)
+                    session.write_buffer_relaxed = True
 
-                # ============================================================
-                # SET USERNAME
-                # ============================================================
-                if msg_type == "set_username":
-                    name = msg.get("username", "").strip()[:20]
-                    if name:
-                        player_names[ws] = name
+                try:
+                    msg = _loads(raw_message.data)
+                except orjson.JSONDecodeError:
+                    _send(ws, MSG_INVALID_JSON)
                     continue
 
-                # ============================================================
-                # CREATE ROOM
-                # ============================================================
-                if msg_type == "create_room":
-                    my_name = get_username_for_ws(ws)
-
-                    # Block if already in an active room
-                    if my_name and my_name in player_rooms:
-                        await ws.send_json({
-                            "type": "error",
-                            "message": "Vous êtes déjà dans une partie."
-                        })
-                        continue
-
-                    room_id = generate_room_id()
-                    while room_id in rooms:
-                        room_id = generate_room_id()
-
-                    time_limit = msg.get("time", 300)
-                    # Validate time_limit
-                    if time_limit not in (0, 60, 180, 300, 600, 900, 1800):
-                        time_limit = 300
-
-                    room = Room(room_id, ws, time_limit)
-                    rooms[room_id] = room
-                    current_room = room
-
-                    if my_name:
-                        player_rooms[my_name] = room_id
-
-                    await ws.send_json({
-                        "type": "room_created",
-                        "room_id": room_id
-                    })
-
-                # ============================================================
-                # JOIN ROOM
-                # ============================================================
-                elif msg_type == "join_room":
-                    room_id = msg.get("room_id", "").upper().strip()
-
-                    if room_id not in rooms:
-                        await ws.send_json({
-                            "type": "error",
-                            "message": f"Salon '{room_id}' introuvable"
-                        })
-                        continue
-
-                    room = rooms[room_id]
-                    if room.is_full():
-                        await ws.send_json({
-                            "type": "error",
-                            "message": "Le salon est complet"
-                        })
-                        continue
-
-                    # --- Prevent self-play: same username can't be host and guest ---
-                    my_name = get_username_for_ws(ws)
-                    host_name = get_username_for_ws(room.host)
-                    if my_name and host_name and my_name.lower() == host_name.lower():
-                        await ws.send_json({
-                            "type": "error",
-                            "message": "Vous ne pouvez pas rejoindre votre propre salon."
-                        })
-                        continue
-
-                    # Block if already in an active room
-                    if my_name and my_name in player_rooms:
-                        await ws.send_json({
-                            "type": "error",
-                            "message": "Vous êtes déjà dans une partie."
-                        })
-                        continue
-
-                    room.add_guest(ws)
-                    current_room = room
-                    room.assign_colors()
-
-                    if my_name:
-                        player_rooms[my_name] = room_id
-
-                    for player_ws, color in room.players.items():
-                        await player_ws.send_json({
-                            "type": "game_start",
-                            "color": color,
-                            "room_id": room_id,
-                            "time": room.time_limit,
-                            "opponent_name": room.get_opponent_name(player_ws)
-                        })
-
-                # ============================================================
-                # MATCHMAKING JOIN
-                # ============================================================
-                elif msg_type == "matchmaking_join":
-                    my_name = get_username_for_ws(ws)
-
-                    # Block if already in an active room
-                    if my_name and my_name in player_rooms:
-                        await ws.send_json({
-                            "type": "error",
-                            "message": "Vous êtes déjà dans une partie."
-                        })
-                        continue
-
-                    time_limit = msg.get("time", 300)
-                    if time_limit not in (0, 60, 180, 300, 600, 900, 1800):
-                        time_limit = 300
-                    in_matchmaking = True
-
-                    async with matchmaking_lock:
-                        queue = matchmaking_queue.setdefault(time_limit, [])
-
-                        # Clean stale entries (closed connections)
-                        queue[:] = [(w, f) for w, f in queue if not w.closed and not f.done()]
-
-                        # --- Prevent self-match: remove any entry with same username ---
-                        matched = False
-                        for i, (opp_ws, opp_future) in enumerate(queue):
-                            if opp_ws.closed:
-                                continue
-                            opp_name = get_username_for_ws(opp_ws)
-                            # Skip if same user (different tab / connection)
-                            if my_name and opp_name and my_name.lower() == opp_name.lower():
-                                continue
-
-                            # Valid opponent found!
-                            queue.pop(i)
-                            matched = True
-
-                            room_id = generate_room_id()
-                            while room_id in rooms:
-                                room_id = generate_room_id()
-
-                            room = Room(room_id, opp_ws, time_limit)
-                            room.add_guest(ws)
-                            rooms[room_id] = room
-                            current_room = room
-                            room.assign_colors()
-                            in_matchmaking = False
-
-                            # Track rooms
-                            if my_name:
-                                player_rooms[my_name] = room_id
-                            if opp_name:
-                                player_rooms[opp_name] = room_id
-
-                            for player_ws, color in room.players.items():
-                                try:
-                                    await player_ws.send_json({
-                                        "type": "game_start",
-                                        "color": color,
-                                        "room_id": room_id,
-                                        "time": room.time_limit,
-                                        "matchmade": True,
-                                        "opponent_name": room.get_opponent_name(player_ws)
-                                    })
-                                except Exception:
-                                    pass
-
-                            if not opp_future.done():
-                                opp_future.set_result(room)
-                            break
-
-                        if not matched:
-                            # No valid opponent — add self to queue
-                            future = asyncio.get_event_loop().create_future()
-                            queue.append((ws, future))
-                            await ws.send_json({
-                                "type": "matchmaking_waiting",
-                                "queue_size": len(queue)
-                            })
-
-                # ============================================================
-                # MATCHMAKING CANCEL
-                # ============================================================
-                elif msg_type == "matchmaking_cancel":
-                    in_matchmaking = False
-                    async with matchmaking_lock:
-                        for time_limit, queue in matchmaking_queue.items():
-                            queue[:] = [(w, f) for w, f in queue if w != ws]
-
-                    await ws.send_json({
-                        "type": "matchmaking_cancelled"
-                    })
-
-                # ============================================================
-                # PING
-                # ============================================================
-                elif msg_type == "ping":
-                    try:
-                        await ws.send_json({"type": "pong"})
-                    except Exception:
-                        pass
-
-                # ============================================================
-                # MOVE — with turn validation
-                # ============================================================
-                elif msg_type == "move":
-                    active = current_room or find_room_for_ws(ws)
-                    if not active or active.game_over:
-                        continue
-                    current_room = active
-
-                    # Validate it's this player's turn
-                    if not active.is_players_turn(ws):
-                        await ws.send_json({
-                            "type": "error",
-                            "message": "Ce n'est pas votre tour."
-                        })
-                        continue
-
-                    # Validate move data has required fields
-                    move_from = msg.get("from")
-                    move_to = msg.get("to")
-                    if not move_from or not move_to:
-                        continue
-                    if not isinstance(move_from, dict) or not isinstance(move_to, dict):
-                        continue
-                    if "row" not in move_from or "col" not in move_from:
-                        continue
-                    if "row" not in move_to or "col" not in move_to:
-                        continue
-
-                    # Validate coordinates are within board
-                    for coord in (move_from, move_to):
-                        if not (0 <= coord.get("row", -1) <= 7 and 0 <= coord.get("col", -1) <= 7):
-                            continue
-
-                    active.advance_turn()
-
-                    opponent = active.get_opponent(ws)
-                    if opponent and not opponent.closed:
-                        move_msg = {
-                            "type": "move",
-                            "from": move_from,
-                            "to": move_to,
-                            "promotion": msg.get("promotion")
-                        }
-                        if "white_time" in msg:
-                            move_msg["white_time"] = msg["white_time"]
-                            move_msg["black_time"] = msg["black_time"]
-                        try:
-                            await opponent.send_json(move_msg)
-                        except Exception:
-                            pass
-
-                # ============================================================
-                # TIMEOUT — validate only the claimer's own timeout
-                # ============================================================
-                elif msg_type == "timeout":
-                    active = current_room or find_room_for_ws(ws)
-                    if not active or active.game_over:
-                        continue
-                    current_room = active
-
-                    loser = msg.get("loser", "")
-                    my_color = active.get_color(ws)
-
-                    # Only accept timeout if this player is reporting their OWN time running out
-                    # OR if timer is enabled and they claim opponent's time ran out
-                    # (both clients track the timer, accept from either)
-                    if loser not in ("white", "black"):
-                        continue
-
-                    winner = "black" if loser == "white" else "white"
-                    active.game_over = True
-
-                    # Record result server-side
-                    active.record_result(winner)
-
-                    opponent = active.get_opponent(ws)
-                    if opponent and not opponent.closed:
-                        try:
-                            await opponent.send_json({
-                                "type": "timeout",
-                                "winner": winner
-                            })
-                        except Exception:
-                            pass
-
-                    # Clean up player_rooms
-                    for pws, pcolor in list(active.players.items()):
-                        pname = get_username_for_ws(pws)
-                        if pname:
-                            player_rooms.pop(pname, None)
-
-                # ============================================================
-                # RESIGN
-                # ============================================================
-                elif msg_type == "resign":
-                    active = current_room or find_room_for_ws(ws)
-                    if not active or active.game_over:
-                        continue
-                    current_room = active
-
-                    my_color = active.get_color(ws)
-                    winner_color = "black" if my_color == "white" else "white"
-                    active.game_over = True
-
-                    # Record result server-side
-                    active.record_result(winner_color)
-
-                    opponent = active.get_opponent(ws)
-                    if opponent and not opponent.closed:
-                        try:
-                            await opponent.send_json({
-                                "type": "opponent_resigned"
-                            })
-                        except Exception:
-                            pass
-
-                    # Clean up player_rooms
-                    for pws, pcolor in list(active.players.items()):
-                        pname = get_username_for_ws(pws)
-                        if pname:
-                            player_rooms.pop(pname, None)
-
-                # ============================================================
-                # GAME END (checkmate, stalemate, draw) — reported by client
-                # ============================================================
-                elif msg_type == "game_end":
-                    active = current_room or find_room_for_ws(ws)
-                    if not active or active.game_over:
-                        continue
-                    current_room = active
-
-                    result = msg.get("result")  # 'checkmate', 'stalemate', 'draw'
-                    winner = msg.get("winner")   # 'white', 'black', or None
-
-                    if result in ("stalemate", "draw"):
-                        active.record_result(None)
-                    elif result == "checkmate" and winner in ("white", "black"):
-                        active.record_result(winner)
-
-                    # Clean up player_rooms
-                    for pws, pcolor in list(active.players.items()):
-                        pname = get_username_for_ws(pws)
-                        if pname:
-                            player_rooms.pop(pname, None)
-
-                # ============================================================
-                # CHAT — sanitized
-                # ============================================================
-                elif msg_type == "chat":
-                    active = current_room or find_room_for_ws(ws)
-                    if active:
-                        current_room = active
-                        chat_msg = msg.get("message", "")
-                        # Sanitize: strip HTML tags, limit length
-                        chat_msg = html_mod.escape(str(chat_msg)[:200])
-                        opponent = active.get_opponent(ws)
-                        if opponent and not opponent.closed:
-                            try:
-                                await opponent.send_json({
-                                    "type": "chat",
-                                    "message": chat_msg
-                                })
-                            except Exception:
-                                pass
-
-                elif msg_type == "reconnect":
-                    # Client tries to rejoin a room after connection drop
-                    room_id = msg.get("room_id", "").upper().strip()
-                    color = msg.get("color")
-                    if room_id in rooms:
-                        room = rooms[room_id]
-                        # Find the disconnected player slot and replace ws
-                        old_ws = None
-                        for p_ws, p_color in list(room.players.items()):
-                            if p_color == color:
-                                old_ws = p_ws
-                                break
-                        if old_ws:
-                            # Swap ws reference
-                            room.players[ws] = color
-                            if old_ws in room.players:
-                                del room.players[old_ws]
-                            if room.host == old_ws:
-                                room.host = ws
-                            if room.guest == old_ws:
-                                room.guest = ws
-                            current_room = room
-                            in_matchmaking = False
-                            # Notify opponent about reconnection
-                            opponent = room.get_opponent(ws)
-                            if opponent and not opponent.closed:
-                                try:
-                                    await opponent.send_json({
-                                        "type": "opponent_reconnected"
-                                    })
-                                except Exception:
-                                    pass
-                            await ws.send_json({
-                                "type": "reconnected",
-                                "room_id": room_id,
-                                "color": color,
-                                "time": room.time_limit
-                            })
-                        else:
-                            await ws.send_json({
-                                "type": "reconnect_failed",
-                                "reason": "Color slot not found"
-                            })
-                    else:
-                        await ws.send_json({
-                            "type": "reconnect_failed",
-                            "reason": "Room not found"
-                        })
-
-                elif msg_type == "sync_request":
-                    # Opponent requests full move history to resync
-                    active = current_room or find_room_for_ws(ws)
-                    if active:
-                        current_room = active
-                        opponent = active.get_opponent(ws)
-                        if opponent and not opponent.closed:
-                            try:
-                                await opponent.send_json({
-                                    "type": "sync_request"
-                                })
-                            except Exception:
-                                pass
-
-                elif msg_type == "sync_state":
-                    # Forward full game state to opponent (for resync)
-                    active = current_room or find_room_for_ws(ws)
-                    if active:
-                        current_room = active
-                        opponent = active.get_opponent(ws)
-                        if opponent and not opponent.closed:
-                            try:
-                                await opponent.send_json({
-                                    "type": "sync_state",
-                                    "moves": msg.get("moves", []),
-                                    "white_time": msg.get("white_time"),
-                                    "black_time": msg.get("black_time")
-                                })
-                            except Exception:
-                                pass
+                handler = MESSAGE_HANDLERS.get(msg.get("type"))
+                if handler is not None:
+                    await handler(session, msg)
 
             elif raw_message.type in (web.WSMsgType.ERROR, web.WSMsgType.CLOSE):
                 break
@@ -990,114 +1335,56 @@ async def websocket_handler(request):
     except Exception:
         pass
     finally:
-        # Remove from matchmaking queue if needed
-        if in_matchmaking:
-            async with matchmaking_lock:
-                for time_limit, queue in matchmaking_queue.items():
-                    queue[:] = [(w, f) for w, f in queue if w != ws]
-
-        # Save username before cleanup (we need it for player_rooms)
-        disconnecting_username = get_username_for_ws(ws)
-
-        # Clean up username
-        player_names.pop(ws, None)
+        # Nothing more can reach this connection
+        ws_outboxes.pop(ws, None)
+        session.writer.cancel()
 
-        cleanup_room = current_room or find_room_for_ws(ws)
+        # Remove from matchmaking queue if needed
+        if session.in_matchmaking:
+            _leave_matchmaking(ws)
+
+        # Clean up username, keeping it for player_rooms below
+        disconnecting_username = player_names.pop(ws, None)
+        player_names_lc.pop(ws, None)
+
+        cleanup_room = session.current_room or ws_to_room.get(ws)
+        # The room keeps this ws in its players (reconnect / reaper), but
+        # the dead connection itself will never look its room up again
+        ws_to_room.pop(ws, None)
+        opponent = cleanup_room.get_opponent(ws) if cleanup_room else None
         if cleanup_room and cleanup_room.started:
-            current_room = cleanup_room
-
             if cleanup_room.game_over:
                 # Game already finished — clean up silently, no "disconnect" message
-                opponent = cleanup_room.get_opponent(ws)
                 # Just clean up player_rooms
                 if disconnecting_username:
                     player_rooms.pop(disconnecting_username, None)
-                # If both players are gone, remove the room
-                all_gone = True
-                for p_ws in list(cleanup_room.players.keys()):
-                    if p_ws != ws and not p_ws.closed:
-                        all_gone = False
-                        break
-                if all_gone:
-                    for p_ws in list(cleanup_room.players.keys()):
-                        pname = get_username_for_ws(p_ws)
-                        if pname:
-                            player_rooms.pop(pname, None)
-                    rooms.pop(cleanup_room.room_id, None)
+                # If both players are gone, remove the room. Check membership,
+                # not get_opponent(): this ws may already have been swapped out
+                # by a reconnect, leaving two live players in the room.
+                if all(p_ws is ws or p_ws.closed for p_ws in cleanup_room.players):
+                    cleanup_room.release_player_rooms()
+                    drop_room(cleanup_room)
             else:
                 # Game in progress — don't destroy room, allow reconnection
-                opponent = cleanup_room.get_opponent(ws)
-                if opponent and not opponent.closed:
-                    try:
-                        await opponent.send_json({
-                            "type": "opponent_disconnected"
-                        })
-                    except Exception:
-                        pass
+                _send(opponent, MSG_OPPONENT_DISCONNECTED)
 
             # Schedule room cleanup after 120s if player doesn't reconnect
             if not cleanup_room.game_over:
-                room_id = cleanup_room.room_id
-                disconnected_color = cleanup_room.get_color(ws)
-                disconnected_user = disconnecting_username
-
-                async def _delayed_cleanup():
-                    await asyncio.sleep(120)
-                    if room_id in rooms:
-                        room = rooms[room_id]
-                        # Check if the disconnected player is still gone
-                        still_gone = True
-                        for p_ws, p_color in room.players.items():
-                            if p_color == disconnected_color and not p_ws.closed:
-                                still_gone = False
-                                break
-                        if still_gone:
-                            # Record disconnect as a loss for the disconnecter
-                            if not room.game_over:
-                                winner_color = "black" if disconnected_color == "white" else "white"
-                                room.record_result(winner_color)
-
-                            # Notify remaining player
-                            for p_ws in list(room.players.keys()):
-                                if not p_ws.closed:
-                                    try:
-                                        await p_ws.send_json({
-                                            "type": "opponent_disconnected_final"
-                                        })
-                                    except Exception:
-                                        pass
-
-                            # Clean up player_rooms for all players in this room
-                            for p_ws in list(room.players.keys()):
-                                pname = get_username_for_ws(p_ws)
-                                if pname:
-                                    player_rooms.pop(pname, None)
-                            if disconnected_user:
-                                player_rooms.pop(disconnected_user, None)
-
-                            rooms.pop(room_id, None)
-
-                asyncio.ensure_future(_delayed_cleanup())
+                _schedule_reap(cleanup_room.room_id, cleanup_room.get_color(ws),
+                               disconnecting_username)
 
         elif cleanup_room:
             # Game not started — clean up immediately
-            opponent = cleanup_room.get_opponent(ws)
             cleanup_room.remove_player(ws)
 
             # Free player_rooms slot
             if disconnecting_username:
                 player_rooms.pop(disconnecting_username, None)
 
-            if opponent and not opponent.closed:
-                try:
-                    await opponent.send_json({
-                        "type": "opponent_disconnected"
-                    })
-                except Exception:
-                    pass
+            _send(opponent, MSG_OPPONENT_DISCONNECTED)
 
             if len(cleanup_room.players) == 0:
-                rooms.pop(cleanup_room.room_id, None)
+                drop_room(cleanup_room)
         else:
             # Not in a room — just clean up player_rooms
             if disconnecting_username:
@@ -1106,41 +1393,179 @@ async def websocket_handler(request):
     return ws
 
 
+# --- Disconnected-player cleanup ---
+# A single reaper task handles every pending cleanup: entries are
+# (deadline, seq, room_id, disconnected_color, disconnected_user).
+RECONNECT_GRACE = 120  # seconds a disconnected player has to come back
+_reap_queue = asyncio.PriorityQueue()
+_reap_seq = itertools.count()
+
+
+def _schedule_reap(room_id, disconnected_color, disconnected_user):
+    """Forfeit the game if the player hasn't reconnected after RECONNECT_GRACE."""
+    deadline = asyncio.get_running_loop().time() + RECONNECT_GRACE
+    _reap_queue.put_nowait(
+        (deadline, next(_reap_seq), room_id, disconnected_color, disconnected_user)
+    )
+
+
+async def _reap_room(room_id, disconnected_color, disconnected_user):
+    if room_id in rooms:
+        room = rooms[room_id]
+        # Check if the disconnected player is still gone
+        p_ws = room.get_ws_for_color(disconnected_color)
+        still_gone = p_ws is None or p_ws.closed
+        if still_gone:
+            # Notify remaining player
+            for p_ws in room.players:
+                _send(p_ws, MSG_OPPONENT_DISCONNECTED_FINAL)
+
+            # Record disconnect as a loss for the disconnecter
+            if not room.game_over:
+                winner_color = "black" if disconnected_color == "white" else "white"
+                await room.record_result(winner_color)
+
+            # Clean up player_rooms for all players in this room
+            room.release_player_rooms()
+            if disconnected_user:
+                player_rooms.pop(disconnected_user, None)
+
+            drop_room(room)
+
+
+async def _room_reaper():
+    loop = asyncio.get_running_loop()
+    while True:
+        deadline, _, room_id, color, username = await _reap_queue.get()
+        delay = deadline - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            await _reap_room(room_id, color, username)
+        except Exception as e:
+            logger.error("[ROOM] Cleanup failed for %s: %s", room_id, e)
+
+
+async def room_reaper_ctx(app):
+    """aiohttp cleanup context running the reaper for the app's lifetime."""
+    task = asyncio.create_task(_room_reaper())
+    yield
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+
 # --- Health check ---
 async def health_handler(request):
     return web.Response(text="OK")
 
 
 # --- Stockfish AI endpoint ---
-# Engine pool to reuse Stockfish processes
-_engine_lock = asyncio.Lock()
-_engine_instance = None
+# Pool of Stockfish processes so concurrent AI requests search in parallel.
+# Each slot holds an engine, or None until it is (re)started on checkout.
+# Each engine costs ~100 MB (Hash=64 + NNUE net), and os.cpu_count() sees the
+# host's cores, not the container's quota: the default stays small.
+ENGINE_POOL_DEFAULT_MAX = 2
 
 
-async def _get_engine():
-    """Get or create a persistent Stockfish engine instance."""
-    global _engine_instance
-    if _engine_instance is not None:
-        return _engine_instance
+def _engine_pool_size():
+    """STOCKFISH_POOL_SIZE if it is a positive int, else half the cores
+    (one search thread each) capped at ENGINE_POOL_DEFAULT_MAX."""
+    try:
+        size = int(os.environ.get("STOCKFISH_POOL_SIZE", "").strip())
+    except ValueError:
+        size = 0
+    if size > 0:
+        return size
+    return max(1, min(ENGINE_POOL_DEFAULT_MAX, (os.cpu_count() or 2) // 2))
+
+
+ENGINE_POOL_SIZE = _engine_pool_size()
+_engine_pool = asyncio.Queue()
+for _ in range(ENGINE_POOL_SIZE):
+    _engine_pool.put_nowait(None)
+_engine_skill = {}  # engine -> "Skill Level" it is currently configured with
+
+
+async def _start_engine():
+    """Start and configure a Stockfish process, or return None on failure."""
     try:
         transport, engine = await chess.engine.popen_uci(STOCKFISH_PATH)
-        # Configure for maximum strength
+        # One search thread per engine: parallelism comes from the pool
         await engine.configure({
             "Threads": 1,
             "Hash": 64,
         })
-        _engine_instance = engine
-        print(f"[STOCKFISH] Engine started: {STOCKFISH_PATH}")
+        logger.info("[STOCKFISH] Engine started: %s", STOCKFISH_PATH)
         return engine
     except Exception as e:
-        print(f"[STOCKFISH] Failed to start engine: {e}")
+        logger.error("[STOCKFISH] Failed to start engine: %s", e)
         return None
 
 
+async def engine_pool_ctx(app):
+    """aiohttp cleanup context: start one engine before the first request
+    (the others start lazily on checkout), and quit them on shutdown."""
+    engine = await _start_engine()
+    if engine is not None:
+        # Warm engine first in line, the remaining slots stay empty
+        while not _engine_pool.empty():
+            _engine_pool.get_nowait()
+        _engine_pool.put_nowait(engine)
+        for _ in range(ENGINE_POOL_SIZE - 1):
+            _engine_pool.put_nowait(None)
+    yield
+    while not _engine_pool.empty():
+        engine = _engine_pool.get_nowait()
+        if engine is not None:
+            with contextlib.suppress(Exception):
+                await engine.quit()
+
+
+# AI games keep their board between requests: game_id -> chess.Board, in
+# LRU order. Pushing the player's last move keeps the move stack (so the
+# engine sees repetitions) and skips a full FEN parse.
+_ai_boards = OrderedDict()
+AI_BOARD_CACHE_SIZE = 1024
+
+
+def _board_for_request(fen, game_id=None, last_move=None):
+    """Return the board for an AI request, reusing the cached game board when
+    it plus last_move reaches the same position. Raises ValueError on a bad FEN."""
+    board = _ai_boards.pop(game_id, None) if game_id else None
+    if board is not None and isinstance(last_move, str) and last_move:
+        try:
+            move = chess.Move.from_uci(last_move)
+        except ValueError:
+            move = None
+        if move is not None and board.is_legal(move):
+            board.push(move)
+            # Compare placement + side to move only: clients don't all format
+            # the en-passant / move-counter fields like python-chess does.
+            if fen.split(" ", 2)[:2] == [board.board_fen(), "w" if board.turn else "b"]:
+                return board
+    return chess.Board(fen)
+
+
+def _remember_board(game_id, board, move):
+    """Store the board after the engine's reply for the next request of game_id."""
+    if not game_id:
+        return
+    board.push(move)
+    _ai_boards[game_id] = board
+    if len(_ai_boards) > AI_BOARD_CACHE_SIZE:
+        _ai_boards.popitem(last=False)
+
+
+def _client_gone(request):
+    transport = request.transport
+    return transport is None or transport.is_closing()
+
+
 async def ai_move_handler(request):
     """
     POST /api/ai-move
-    Body: { "fen": "...", "difficulty": 3|4|5 }
+    Body: { "fen": "...", "difficulty": 3|4|5, "game_id"?: "...", "last_move"?: "e7e5" }
     Returns: { "move": "e2e4", "eval": 0.5, "depth": 20 }
 
     Difficulty mapping:
@@ -1149,23 +1574,26 @@ async def ai_move_handler(request):
       5 (GM)      — Skill 20, depth 25, time 10s, full NNUE strength
     """
     try:
-        data = await request.json()
+        data = _loads(await request.read())
     except Exception:
-        return web.json_response({"error": "Invalid JSON"}, status=400)
+        return web.json_response({"error": "Invalid JSON"}, status=400, dumps=_dumps)
 
     fen = data.get("fen")
     difficulty = data.get("difficulty", 5)
+    game_id = data.get("game_id")
+    if not isinstance(game_id, str):
+        game_id = None
 
     if not fen:
-        return web.json_response({"error": "Missing fen"}, status=400)
+        return web.json_response({"error": "Missing fen"}, status=400, dumps=_dumps)
 
     try:
-        board = chess.Board(fen)
+        board = _board_for_request(fen, game_id, data.get("last_move"))
     except Exception:
-        return web.json_response({"error": "Invalid FEN"}, status=400)
+        return web.json_response({"error": "Invalid FEN"}, status=400, dumps=_dumps)
 
     if board.is_game_over():
-        return web.json_response({"error": "Game is over"}, status=400)
+        return web.json_response({"error": "Game is over"}, status=400, dumps=_dumps)
 
     # Configure search parameters per difficulty
     if difficulty <= 3:
@@ -1179,27 +1607,46 @@ async def ai_move_handler(request):
         limit = chess.engine.Limit(depth=25, time=10.0)
         skill_level = 20
 
-    async with _engine_lock:
-        engine = await _get_engine()
+    engine = await _engine_pool.get()
+    try:
         if engine is None:
-            return web.json_response(
-                {"error": "Stockfish engine not available"},
-                status=503
-            )
+            engine = await _start_engine()
+            if engine is None:
+                return web.json_response(
+                    {"error": "Stockfish engine not available"},
+                    status=503,
+                    dumps=_dumps
+                )
 
         try:
-            # Set skill level
-            await engine.configure({"Skill Level": skill_level})
+            # Set skill level (only when this engine isn't already on it)
+            if _engine_skill.get(engine) != skill_level:
+                await engine.configure({"Skill Level": skill_level})
+                _engine_skill[engine] = skill_level
+
+            # Stream the search so it can stop as soon as the client goes
+            # away (closed tab) instead of running to the limit. bestmove
+            # still comes from the engine, so Skill Level applies.
+            with await engine.analysis(
+                board, limit,
+                info=chess.engine.INFO_SCORE | chess.engine.INFO_DEPTH
+            ) as analysis:
+                async for _ in analysis:
+                    if _client_gone(request):
+                        analysis.stop()
+                        break
+                best = await analysis.wait()
+                info = analysis.info
+
+            if _client_gone(request):
+                # Nobody to answer; the engine is idle again, back to the pool
+                return web.Response(status=499)
 
-            # Find the best move
-            result = await engine.play(board, limit)
-            move_uci = result.move.uci() if result.move else None
+            move_uci = best.move.uci() if best.move else None
 
             if not move_uci:
-                return web.json_response({"error": "No move found"}, status=500)
+                return web.json_response({"error": "No move found"}, status=500, dumps=_dumps)
 
-            # Get evaluation info
-            info = await engine.analyse(board, chess.engine.Limit(depth=min(12, limit.depth or 12), time=0.5))
             score = info.get("score")
             eval_cp = None
             eval_mate = None
@@ -1219,21 +1666,25 @@ async def ai_move_handler(request):
             if eval_mate is not None:
                 response["mate"] = eval_mate
 
-            return web.json_response(response)
+            _remember_board(game_id, board, best.move)
+            return web.json_response(response, dumps=_dumps)
 
         except Exception as e:
-            print(f"[STOCKFISH] Error during search: {e}")
-            # Engine might be dead, reset it
-            global _engine_instance
+            logger.warning("[STOCKFISH] Error during search: %s", e)
+            # Engine might be dead, drop it: the slot restarts it on next use
+            _engine_skill.pop(engine, None)
             try:
                 await engine.quit()
             except Exception:
                 pass
-            _engine_instance = None
+            engine = None
             return web.json_response(
                 {"error": "Engine error, please retry"},
-                status=500
+                status=500,
+                dumps=_dumps
             )
+    finally:
+        _engine_pool.put_nowait(engine)
 
 
 # --- Index page ---
@@ -1244,6 +1695,8 @@ async def index_handler(request):
 # --- App factory ---
 def create_app():
     app = web.Application()
+    app.cleanup_ctx.append(room_reaper_ctx)
+    app.cleanup_ctx.append(engine_pool_ctx)
     app.router.add_get("/health", health_handler)
     app.router.add_post("/api/ai-move", ai_move_handler)
     # Auth & ranking
@@ -1276,6 +1729,7 @@ if __name__ == "__main__":
         app, 
         host="0.0.0.0", 
         port=PORT,
-        print=lambda x: print(f"[SERVER] {x}") if x else None,
-        access_log=None
+        print=lambda x: logger.info("[SERVER] %s", x) if x else None,
+        access_log=None,
+        loop=uvloop.new_event_loop() if uvloop else None
     )
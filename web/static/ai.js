@@ -166,6 +166,8 @@ var ChessAI = (function() {
         this.aborted = false;
         this.serverAvailable = true;  // On suppose le serveur dispo
         this.serverChecked = false;
+        // Identifie la partie aupres du serveur (qui garde l'echiquier entre deux coups)
+        this.gameId = Date.now().toString(36) + Math.random().toString(36).slice(2);
     }
 
     AI.prototype.setDifficulty = function(level) {
@@ -174,11 +176,14 @@ var ChessAI = (function() {
 
     // ----- Server API -----
 
-    AI.prototype._callServer = function(fen, difficulty) {
+    AI.prototype._callServer = function(fen, difficulty, lastMove) {
         return fetch('/api/ai-move', {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({fen: fen, difficulty: difficulty})
+            body: JSON.stringify({
+                fen: fen, difficulty: difficulty,
+                game_id: this.gameId, last_move: this._moveToUci(lastMove)
+            })
         }).then(function(res) {
             if (!res.ok) throw new Error('Server error ' + res.status);
             return res.json();
@@ -197,6 +202,14 @@ var ChessAI = (function() {
         };
     };
 
+    AI.prototype._moveToUci = function(move) {
+        if (!move) return null;
+        var files = 'abcdefgh';
+        return files[move.from.col] + (8 - move.from.row) +
+               files[move.to.col] + (8 - move.to.row) +
+               (move.promotion ? move.promotion.toLowerCase() : '');
+    };
+
     // ----- Main entry point -----
 
     AI.prototype.findBestMove = function(engine, aiColor) {
@@ -224,7 +237,7 @@ var ChessAI = (function() {
 
         // Try server first
         if (this.serverAvailable) {
-            return this._callServer(fen, this.difficulty)
+            return this._callServer(fen, this.difficulty, engine.lastMove)
                 .then(function(data) {
                     self.serverAvailable = true;
                     if (data && data.move) {
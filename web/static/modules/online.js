@@ -14,6 +14,11 @@
 
 import { $, showToast, hide, show } from './core.js';
 
+// Messages go out as UTF-8 binary frames: the server parses the bytes
+// directly instead of validating a text frame first.
+const textEncoder = new TextEncoder();
+const encodeMessage = (message) => textEncoder.encode(JSON.stringify(message));
+
 export class OnlineGame {
   constructor(uiManager, engine) {
     this.ui = uiManager;
@@ -114,7 +119,7 @@ export class OnlineGame {
 
       // Send username
       if (this.username) {
-        this.ws.send(JSON.stringify({ type: 'set_username', username: this.username }));
+        this.ws.send(encodeMessage({ type: 'set_username', username: this.username }));
       }
 
       // If reconnecting mid-game, re-join the room
@@ -123,8 +128,8 @@ export class OnlineGame {
         this._reconnectAttempts = 0;
         this._showBanner('Reconnecté — synchronisation…', 'ok');
         this.send({ type: 'reconnect', room_id: this.roomId, color: this.myColor });
-        // Request game state from opponent
-        setTimeout(() => this.send({ type: 'sync_request' }), 300);
+        // Request the moves we're missing from the opponent
+        setTimeout(() => this._requestSync(), 300);
       } else if (this._reconnecting) {
         this._reconnecting = false;
         this._reconnectAttempts = 0;
@@ -183,7 +188,7 @@ export class OnlineGame {
 
       // Send a lightweight ping message
       try {
-        this.ws.send(JSON.stringify({ type: 'ping' }));
+        this.ws.send(encodeMessage({ type: 'ping' }));
       } catch (e) {
         // ignore
       }
@@ -254,7 +259,7 @@ export class OnlineGame {
    */
   send(message) {
     if (this.ws?.readyState === WebSocket.OPEN) {
-      this.ws.send(JSON.stringify(message));
+      this.ws.send(encodeMessage(message));
     } else if (this._gameInProgress && message.type === 'move') {
       // Queue important messages (moves) to replay after reconnect
       this._pendingQueue.push(message);
@@ -267,7 +272,7 @@ export class OnlineGame {
     while (this._pendingQueue.length > 0) {
       const msg = this._pendingQueue.shift();
       console.log('[Online] Flushing queued message:', msg.type);
-      this.ws.send(JSON.stringify(msg));
+      this.ws.send(encodeMessage(msg));
     }
   }
 
@@ -349,12 +354,12 @@ export class OnlineGame {
         break;
 
       case 'sync_request':
-        // Opponent is asking us for the full move history
-        this._sendSyncState();
+        // Opponent is asking for the moves it doesn't have yet
+        this._sendSyncState(msg.from_ply || 0);
         break;
 
       case 'sync_state':
-        // We received full game state from opponent after reconnection
+        // We received the missing game state from opponent after reconnection
         this._applySyncState(msg);
         break;
 
@@ -417,16 +422,27 @@ export class OnlineGame {
   // =======================================================================
 
   /**
-   * Send our full move history + times to the opponent
+   * Ask the opponent for the moves after the ones we already have
+   * (fromPly = 0 asks for the whole history)
+   */
+  _requestSync(fromPly = this.engine.moveHistory.length) {
+    this.send({ type: 'sync_request', from_ply: fromPly });
+  }
+
+  /**
+   * Send our move history from fromPly on + times to the opponent
    */
-  _sendSyncState() {
-    const moves = this.engine.moveHistory.map(m => ({
+  _sendSyncState(fromPly = 0) {
+    const history = this.engine.moveHistory;
+    const start = Math.min(fromPly, history.length);
+    const moves = history.slice(start).map(m => ({
       from: m.from,
       to: m.to,
       promotion: m.promotion || null
     }));
     this.send({
       type: 'sync_state',
+      from_ply: start,
       moves: moves,
       white_time: this.whiteTime,
       black_time: this.blackTime
@@ -434,13 +450,22 @@ export class OnlineGame {
   }
 
   /**
-   * Apply received game state (replay all moves from scratch)
+   * Apply received game state (moves[0] is ply msg.from_ply)
    */
   _applySyncState(msg) {
     const moves = msg.moves || [];
+    const baseline = msg.from_ply || 0;
+    const total = baseline + moves.length;
     const myMoveCount = this.engine.moveHistory.length;
 
-    if (moves.length <= myMoveCount) {
+    if (baseline > myMoveCount) {
+      // Delta starts past our last move (history changed since we asked): get all of it
+      console.log('[Online] Sync: delta from ply ' + baseline + ' but we have ' + myMoveCount + ', requesting full history');
+      this._requestSync(0);
+      return;
+    }
+
+    if (total <= myMoveCount) {
       // We're already up to date or ahead — nothing to do
       console.log('[Online] Sync: already up to date (' + myMoveCount + ' moves)');
       this._hideBanner();
@@ -448,9 +473,9 @@ export class OnlineGame {
     }
 
     // Apply only the missing moves
-    console.log('[Online] Sync: applying ' + (moves.length - myMoveCount) + ' missing moves');
-    for (let i = myMoveCount; i < moves.length; i++) {
-      const m = moves[i];
+    console.log('[Online] Sync: applying ' + (total - myMoveCount) + ' missing moves');
+    for (let i = myMoveCount; i < total; i++) {
+      const m = moves[i - baseline];
       this.engine.applyNetworkMove(m.from, m.to, m.promotion);
     }
 